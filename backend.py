@@ -1,14 +1,20 @@
 # backend.py
 import os
+import re
+import time
+import queue
+import functools
+import threading
 import pyodbc
 import datetime
 import calendar
 import traceback
+from contextlib import contextmanager
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 import uvicorn
 
@@ -39,15 +45,67 @@ CONN_STR = os.environ.get("SQLSERVER_CONN") or (
 print("[INFO] Using connection string:", CONN_STR)
 
 
-def get_conn():
-    return pyodbc.connect(CONN_STR, timeout=10)
+# We keep our own pool of long-lived connections, so turn off the ODBC driver manager's pooling
+pyodbc.pooling = False
+# Endpoints are plain `def`, so FastAPI runs them in its worker threadpool and the event
+# loop never blocks on pyodbc; the pool only bounds how many of those threads hit the DB.
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+
+
+def connect_db():
+    conn = pyodbc.connect(CONN_STR, timeout=10)
+    conn.autocommit = False
+    return conn
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of pyodbc connections.
+    Slots start empty (None) and are connected on first checkout, so importing the
+    module does not require the database to be reachable.
+    """
+
+    def __init__(self, size, timeout):
+        self._timeout = timeout
+        self._slots = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._slots.put(None)
+
+    @contextmanager
+    def acquire(self):
+        try:
+            conn = self._slots.get(timeout=self._timeout)
+        except queue.Empty:
+            raise HTTPException(status_code=503, detail="database busy, try again")
+        try:
+            if conn is None:
+                conn = connect_db()
+            yield conn
+        finally:
+            # end whatever transaction is still open (failed work, or the implicit one a
+            # read-only endpoint never commits) so the next checkout starts clean;
+            # drop the connection if it is no longer usable
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except pyodbc.Error:
+                    try:
+                        conn.close()
+                    except pyodbc.Error:
+                        pass
+                    conn = None
+            self._slots.put(conn)
+
+
+pool = ConnectionPool(POOL_SIZE, POOL_TIMEOUT)
 
 
 # Ensure required tables exist
 def ensure_tables_exist():
     conn = None
     try:
-        conn = get_conn()
+        conn = connect_db()
         cur = conn.cursor()
 
         # devices
@@ -72,14 +130,33 @@ def ensure_tables_exist():
                 id INT IDENTITY(1,1) PRIMARY KEY,
                 device_id NVARCHAR(100) NOT NULL,
                 status NVARCHAR(20) NOT NULL,
-                created_at DATETIME2 NOT NULL
+                created_at DATETIME2 NOT NULL CONSTRAINT DF_ProductionStatus_created_at DEFAULT SYSUTCDATETIME()
             );
-            CREATE INDEX IX_ProductionStatus_created_at ON dbo.ProductionStatus(created_at);
             CREATE INDEX IX_ProductionStatus_device_id ON dbo.ProductionStatus(device_id);
         END
         """)
         conn.commit()
 
+        # Let the server stamp created_at on tables created before the default existed
+        cur.execute("""
+        IF NOT EXISTS (SELECT * FROM sys.default_constraints
+                       WHERE parent_object_id = OBJECT_ID(N'[dbo].[ProductionStatus]')
+                         AND COL_NAME(parent_object_id, parent_column_id) = N'created_at')
+            ALTER TABLE dbo.ProductionStatus
+                ADD CONSTRAINT DF_ProductionStatus_created_at DEFAULT SYSUTCDATETIME() FOR created_at;
+        """)
+        conn.commit()
+
+        # Covering index for the date-range aggregations (created_at range [+ device_id], status).
+        # It replaces the single-column created_at index on databases created before it existed.
+        cur.execute("""
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'IX_PS_created_dev_incl_status' AND object_id = OBJECT_ID(N'[dbo].[ProductionStatus]'))
+            CREATE INDEX IX_PS_created_dev_incl_status ON dbo.ProductionStatus(created_at, device_id) INCLUDE (status);
+        IF EXISTS (SELECT * FROM sys.indexes WHERE name = N'IX_ProductionStatus_created_at' AND object_id = OBJECT_ID(N'[dbo].[ProductionStatus]'))
+            DROP INDEX IX_ProductionStatus_created_at ON dbo.ProductionStatus;
+        """)
+        conn.commit()
+
         # DailyMetrics (one row per device per date)
         cur.execute("""
         IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[DailyMetrics]') AND type in (N'U'))
@@ -96,6 +173,13 @@ def ensure_tables_exist():
         """)
         conn.commit()
 
+        # Covering index for the per-day metric lookup in logs_day
+        cur.execute("""
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'IX_DailyMetrics_date_device' AND object_id = OBJECT_ID(N'[dbo].[DailyMetrics]'))
+            CREATE INDEX IX_DailyMetrics_date_device ON dbo.DailyMetrics([date], device_id) INCLUDE (metric);
+        """)
+        conn.commit()
+
     except Exception as e:
         print("[WARN] ensure_tables_exist:", e)
     finally:
@@ -129,14 +213,73 @@ class DailyMetricIn(BaseModel):
     metric: Optional[str] = None
 
 
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # restrict in production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Response models: with a response_model FastAPI serializes through pydantic directly
+# instead of running jsonable_encoder over the returned dicts first.
+class OkOut(BaseModel):
+    ok: bool
+
+
+class PassFailOut(BaseModel):
+    pass_: List[int] = Field(alias="pass")
+    fail: List[int]
+
+
+class DayDataOut(PassFailOut):
+    date: str
+    hours: List[int]
+
+
+class WeekDataOut(PassFailOut):
+    range: str
+    labels: List[str]
+
+
+class MonthDataOut(PassFailOut):
+    month: str
+    labels: List[str]
+
+
+class YearDataOut(PassFailOut):
+    year: int
+    labels: List[str]
+
+
+class DeviceLogOut(BaseModel):
+    device_id: str
+    name: str
+    pass_: int = Field(alias="pass")
+    fail: int
+    total: int
+    metric: str
+
+
+# CORS - only needed when the dashboard is opened from another origin (window.API_BASE).
+# Set env CORS_ORIGINS to a comma-separated list; an empty value disables the middleware.
+CORS_ORIGINS = [o.strip() for o in os.environ.get(
+    "CORS_ORIGINS", "http://localhost:5500,http://127.0.0.1:5500").split(",") if o.strip()]
+if CORS_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        max_age=86400,  # let browsers cache preflight responses for a day
+    )
+
+
+HOURS = tuple(range(24))
+_DATE_RE = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}")
+
+
+def parse_date_str(value: str, field: str = "date_str") -> datetime.date:
+    # shape check first, so malformed input is rejected without raising inside fromisoformat
+    if _DATE_RE.fullmatch(value):
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:  # right shape, impossible date (e.g. 2025-02-30)
+            pass
+    raise HTTPException(status_code=400, detail=f"{field} must be YYYY-MM-DD")
 
 
 def make_device_filter_clause(device: Optional[str]):
@@ -145,100 +288,139 @@ def make_device_filter_clause(device: Optional[str]):
     return "", []
 
 
+def make_date_range(first: datetime.date, last: datetime.date):
+    # bounds covering the days first..last (inclusive) for "created_at >= ? AND created_at < ?"
+    # (index seekable); 9999-12-31 has no next day, so its range ends at datetime.max instead
+    start = datetime.datetime.combine(first, datetime.time.min)
+    if last == datetime.date.max:
+        return [start, datetime.datetime.max]
+    return [start, datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time.min)]
+
+
+# In-memory TTL cache for the read endpoints the dashboard polls.
+# Writes made through this API drop the affected groups right away; rows that
+# tcpclient.py inserts straight into the DB show up once the TTL runs out.
+CACHE_MAX_ENTRIES = 1024
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def cached(group: str, ttl):
+    # ttl: seconds, or a function of the endpoint's keyword arguments returning seconds
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (group, func.__name__, args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            hit = _cache.get(key)
+            if hit and hit[0] > now:
+                return hit[1]
+            result = func(*args, **kwargs)
+            with _cache_lock:
+                if len(_cache) >= CACHE_MAX_ENTRIES:
+                    for k in [k for k, (exp, _) in _cache.items() if exp <= now]:
+                        del _cache[k]
+                    if len(_cache) >= CACHE_MAX_ENTRIES:
+                        _cache.clear()
+                _cache[key] = (now + (ttl(**kwargs) if callable(ttl) else ttl), result)
+            return result
+        return wrapper
+    return decorator
+
+
+def day_ttl(date_str: str, **_) -> float:
+    # Past days hardly change, so cache them longer. Yesterday still counts as recent:
+    # API rows are stamped in UTC and tcpclient rows in local time.
+    recent = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    return 15 if date_str >= recent else 300
+
+
+def invalidate_cache(*groups: str):
+    with _cache_lock:
+        for k in [k for k in _cache if k[0] in groups]:
+            del _cache[k]
+
+
 # Devices endpoints
 @app.get("/devices", response_model=List[DeviceOut])
+@cached("devices", ttl=300)
 def list_devices():
-    conn = get_conn()
-    try:
+    with pool.acquire() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id, name, status, last_seen FROM devices ORDER BY id")
+        # style 127 = ISO 8601, so last_seen arrives as a ready-to-send string (or NULL)
+        cur.execute("SELECT id, name, status, CONVERT(varchar(33), last_seen, 127) AS last_seen FROM devices ORDER BY id")
         rows = cur.fetchall()
-        out = []
-        for r in rows:
-            last = None
-            if r.last_seen:
-                try:
-                    last = r.last_seen.isoformat()
-                except:
-                    last = str(r.last_seen)
-            out.append({"id": int(r.id), "name": r.name, "status": int(r.status), "last_seen": last})
-        return out
-    finally:
-        conn.close()
+    return [{"id": r.id, "name": r.name, "status": r.status, "last_seen": r.last_seen} for r in rows]
 
 
 @app.post("/devices", response_model=DeviceOut)
 def add_device(d: DeviceIn):
-    conn = get_conn()
-    try:
+    with pool.acquire() as conn:
         cur = conn.cursor()
-        now = datetime.datetime.utcnow()
-        cur.execute("INSERT INTO devices (name, status, last_seen) VALUES (?, ?, ?)", (d.name, 1, now))
-        conn.commit()
-        cur.execute("SELECT TOP 1 id, name, status, last_seen FROM devices ORDER BY id DESC")
+        cur.execute(
+            "INSERT INTO devices (name, status, last_seen) "
+            "OUTPUT INSERTED.id, INSERTED.name, INSERTED.status, CONVERT(varchar(33), INSERTED.last_seen, 127) AS last_seen "
+            "VALUES (?, ?, SYSUTCDATETIME())",
+            (d.name, 1))
         r = cur.fetchone()
-        last = r.last_seen.isoformat() if r.last_seen else None
-        return {"id": int(r.id), "name": r.name, "status": int(r.status), "last_seen": last}
-    finally:
-        conn.close()
+        conn.commit()
+    invalidate_cache("devices", "logs")
+    return {"id": r.id, "name": r.name, "status": r.status, "last_seen": r.last_seen}
 
 
-@app.delete("/devices/{device_id}")
+@app.delete("/devices/{device_id}", response_model=OkOut)
 def delete_device(device_id: int):
-    conn = get_conn()
-    try:
+    with pool.acquire() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM devices WHERE id = ?", (device_id,))
         conn.commit()
-        return {"ok": True}
-    finally:
-        conn.close()
+    invalidate_cache("devices", "logs")
+    return {"ok": True}
 
 
-@app.put("/devices/{device_id}/status")
+@app.put("/devices/{device_id}/status", response_model=OkOut)
 def update_device_status(device_id: int, status: int = Query(..., description="0 or 1")):
     if status not in (0, 1):
         raise HTTPException(status_code=400, detail="status must be 0 or 1")
-    conn = get_conn()
-    try:
+    with pool.acquire() as conn:
         cur = conn.cursor()
-        now = datetime.datetime.utcnow()
-        cur.execute("UPDATE devices SET status = ?, last_seen = ? WHERE id = ?", (status, now, device_id))
+        cur.execute("UPDATE devices SET status = ?, last_seen = SYSUTCDATETIME() WHERE id = ?", (status, device_id))
         conn.commit()
-        return {"ok": True}
-    finally:
-        conn.close()
+    invalidate_cache("devices")
+    return {"ok": True}
 
 
 # ingest ProductionStatus
-@app.post("/status")
+@app.post("/status", response_model=OkOut)
 def post_status(s: StatusIn):
-    conn = get_conn()
     try:
-        cur = conn.cursor()
-        ts = s.created_at or datetime.datetime.utcnow()
-        cur.execute("INSERT INTO ProductionStatus (device_id, status, created_at) VALUES (?, ?, ?)",
-                    (s.device_id, s.status, ts))
-        conn.commit()
+        with pool.acquire() as conn:
+            cur = conn.cursor()
+            if s.created_at:
+                cur.execute("INSERT INTO ProductionStatus (device_id, status, created_at) VALUES (?, ?, ?)",
+                            (s.device_id, s.status, s.created_at))
+            else:
+                # created_at defaults to SYSUTCDATETIME() on the server
+                cur.execute("INSERT INTO ProductionStatus (device_id, status) VALUES (?, ?)",
+                            (s.device_id, s.status))
+            conn.commit()
+        invalidate_cache("data", "logs")
         # simple ack
         return {"ok": True}
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 # Data endpoints with optional ?device=...
-@app.get("/data/day/{date_str}")
+@app.get("/data/day/{date_str}", response_model=DayDataOut)
+@cached("data", ttl=day_ttl)
 def data_day(date_str: str, device: Optional[str] = None):
     # date_str: YYYY-MM-DD
-    try:
-        datetime.date.fromisoformat(date_str)
-    except Exception:
-        raise HTTPException(status_code=400, detail="date_str must be YYYY-MM-DD")
-    conn = get_conn()
-    try:
+    day = parse_date_str(date_str)
+    with pool.acquire() as conn:
         cur = conn.cursor()
         clause, params = make_device_filter_clause(device)
         q = f"""
@@ -246,213 +428,194 @@ def data_day(date_str: str, device: Optional[str] = None):
                    SUM(CASE WHEN status = 'Pass' THEN 1 ELSE 0 END) as pass_sum,
                    SUM(CASE WHEN status = 'Fail' THEN 1 ELSE 0 END) as fail_sum
             FROM ProductionStatus
-            WHERE CONVERT(varchar(10), created_at, 120) = ? {clause}
+            WHERE created_at >= ? AND created_at < ? {clause}
             GROUP BY DATEPART(hour, created_at)
         """
-        exec_params = (date_str, *params) if params else (date_str,)
+        exec_params = make_date_range(day, day) + params
         cur.execute(q, exec_params)
         rows = cur.fetchall()
-        pass_arr = [0] * 24
-        fail_arr = [0] * 24
-        for r in rows:
-            hr = int(r[0]) if r[0] is not None else 0
-            if 0 <= hr < 24:
-                pass_arr[hr] = int(r[1] or 0)
-                fail_arr[hr] = int(r[2] or 0)
-        return {"date": date_str, "hours": list(range(24)), "pass": pass_arr, "fail": fail_arr}
-    finally:
-        conn.close()
+    pass_arr = [0] * 24
+    fail_arr = [0] * 24
+    # DATEPART/SUM come back as ints; created_at is NOT NULL so hr is always 0-23
+    for hr, p, f in rows:
+        pass_arr[hr] = p
+        fail_arr[hr] = f
+    return {"date": date_str, "hours": HOURS, "pass": pass_arr, "fail": fail_arr}
 
 
-@app.get("/data/week/{year}/{month}/{week}")
+@app.get("/data/week/{year}/{month}/{week}", response_model=WeekDataOut)
+@cached("data", ttl=60)
 def data_week(year: int, month: int, week: int, device: Optional[str] = None):
-    try:
-        year = int(year); month = int(month); week = int(week)
-        days_in_month = calendar.monthrange(year, month)[1]
-        start_day = (week - 1) * 7 + 1
-        end_day = min(start_day + 6, days_in_month)
-        start_date = datetime.date(year, month, start_day)
-        end_date = datetime.date(year, month, end_day)
-
-        clause, params = make_device_filter_clause(device)
-        q = f"""
-            SELECT CONVERT(varchar(10), created_at, 120) as d,
-                   SUM(CASE WHEN status='Pass' THEN 1 ELSE 0 END) as pass_sum,
-                   SUM(CASE WHEN status='Fail' THEN 1 ELSE 0 END) as fail_sum
-            FROM ProductionStatus
-            WHERE CONVERT(varchar(10), created_at, 120) BETWEEN ? AND ? {clause}
-            GROUP BY CONVERT(varchar(10), created_at, 120)
-            ORDER BY d
-        """
-        conn = get_conn()
+    year = int(year); month = int(month); week = int(week)
+    days_in_month = calendar.monthrange(year, month)[1]
+    start_day = (week - 1) * 7 + 1
+    end_day = min(start_day + 6, days_in_month)
+    start_date = datetime.date(year, month, start_day)
+    end_date = datetime.date(year, month, end_day)
+
+    clause, params = make_device_filter_clause(device)
+    q = f"""
+        SELECT DATEPART(day, created_at) as day,
+               SUM(CASE WHEN status='Pass' THEN 1 ELSE 0 END) as pass_sum,
+               SUM(CASE WHEN status='Fail' THEN 1 ELSE 0 END) as fail_sum
+        FROM ProductionStatus
+        WHERE created_at >= ? AND created_at < ? {clause}
+        GROUP BY DATEPART(day, created_at)
+    """
+    with pool.acquire() as conn:
         cur = conn.cursor()
-        params_exec = [start_date.isoformat(), end_date.isoformat()] + params
+        params_exec = make_date_range(start_date, end_date) + params
         cur.execute(q, params_exec)
         rows = cur.fetchall()
-        mapd = {r[0]: {"pass": int(r[1] or 0), "fail": int(r[2] or 0)} for r in rows}
-        labels, pass_list, fail_list = [], [], []
-        curdate = start_date
-        while curdate <= end_date:
-            ds = curdate.isoformat()
-            labels.append(ds)
-            if ds in mapd:
-                pass_list.append(mapd[ds]["pass"])
-                fail_list.append(mapd[ds]["fail"])
-            else:
-                pass_list.append(0)
-                fail_list.append(0)
-            curdate += datetime.timedelta(days=1)
-        return {"range": f"{start_date.isoformat()} to {end_date.isoformat()}", "labels": labels, "pass": pass_list, "fail": fail_list}
-    finally:
-        try: conn.close()
-        except: pass
-
-
-@app.get("/data/month/{year}/{month}")
+    num_days = end_day - start_day + 1
+    labels = [(start_date + datetime.timedelta(days=i)).isoformat() for i in range(num_days)]
+    pass_list = [0] * num_days
+    fail_list = [0] * num_days
+    for day, p, f in rows:
+        pass_list[day - start_day] = p
+        fail_list[day - start_day] = f
+    return {"range": f"{start_date.isoformat()} to {end_date.isoformat()}", "labels": labels, "pass": pass_list, "fail": fail_list}
+
+
+@app.get("/data/month/{year}/{month}", response_model=MonthDataOut)
+@cached("data", ttl=60)
 def data_month(year: int, month: int, device: Optional[str] = None):
-    try:
-        year = int(year); month = int(month)
-        days_in_month = calendar.monthrange(year, month)[1]
-        clause, params = make_device_filter_clause(device)
-        q = f"""
-            SELECT DATEPART(day, created_at) as day,
-                   SUM(CASE WHEN status='Pass' THEN 1 ELSE 0 END) as pass_sum,
-                   SUM(CASE WHEN status='Fail' THEN 1 ELSE 0 END) as fail_sum
-            FROM ProductionStatus
-            WHERE YEAR(created_at)=? AND MONTH(created_at)=? {clause}
-            GROUP BY DATEPART(day, created_at)
-            ORDER BY DATEPART(day, created_at)
-        """
-        conn = get_conn()
+    year = int(year); month = int(month)
+    days_in_month = calendar.monthrange(year, month)[1]
+    start_date = datetime.date(year, month, 1)
+    clause, params = make_device_filter_clause(device)
+    # week of month: days 1-7 -> 1, 8-14 -> 2, ...
+    q = f"""
+        SELECT (DATEPART(day, created_at) - 1) / 7 + 1 as wk,
+               SUM(CASE WHEN status='Pass' THEN 1 ELSE 0 END) as pass_sum,
+               SUM(CASE WHEN status='Fail' THEN 1 ELSE 0 END) as fail_sum
+        FROM ProductionStatus
+        WHERE created_at >= ? AND created_at < ? {clause}
+        GROUP BY (DATEPART(day, created_at) - 1) / 7 + 1
+    """
+    with pool.acquire() as conn:
         cur = conn.cursor()
-        params_exec = [year, month] + params
+        params_exec = make_date_range(start_date, datetime.date(year, month, days_in_month)) + params
         cur.execute(q, params_exec)
         rows = cur.fetchall()
-        weeks = {}
-        for r in rows:
-            day = int(r[0] or 1)
-            week_idx = (day - 1) // 7 + 1
-            if week_idx not in weeks:
-                weeks[week_idx] = {"pass": 0, "fail": 0}
-            weeks[week_idx]["pass"] += int(r[1] or 0)
-            weeks[week_idx]["fail"] += int(r[2] or 0)
-        max_week = (days_in_month + 6) // 7
-        labels = [f"Tuần {w}" for w in range(1, max_week + 1)]
-        pass_list = [weeks[w]["pass"] if w in weeks else 0 for w in range(1, max_week + 1)]
-        fail_list = [weeks[w]["fail"] if w in weeks else 0 for w in range(1, max_week + 1)]
-        return {"month": f"{year:04d}-{month:02d}", "labels": labels, "pass": pass_list, "fail": fail_list}
-    finally:
-        try: conn.close()
-        except: pass
-
-
-@app.get("/data/year/{year}")
+    max_week = (days_in_month + 6) // 7
+    labels = [f"Tuần {w}" for w in range(1, max_week + 1)]
+    pass_list = [0] * max_week
+    fail_list = [0] * max_week
+    for wk, p, f in rows:
+        pass_list[wk - 1] = p
+        fail_list[wk - 1] = f
+    return {"month": f"{year:04d}-{month:02d}", "labels": labels, "pass": pass_list, "fail": fail_list}
+
+
+@app.get("/data/year/{year}", response_model=YearDataOut)
+@cached("data", ttl=60)
 def data_year(year: int, device: Optional[str] = None):
-    try:
-        year = int(year)
-        clause, params = make_device_filter_clause(device)
-        q = f"""
-            SELECT MONTH(created_at) as m,
-                   SUM(CASE WHEN status='Pass' THEN 1 ELSE 0 END) as sum_pass,
-                   SUM(CASE WHEN status='Fail' THEN 1 ELSE 0 END) as sum_fail
-            FROM ProductionStatus
-            WHERE YEAR(created_at)=? {clause}
-            GROUP BY MONTH(created_at)
-            ORDER BY MONTH(created_at)
-        """
-        conn = get_conn()
+    year = int(year)
+    clause, params = make_device_filter_clause(device)
+    q = f"""
+        SELECT MONTH(created_at) as m,
+               SUM(CASE WHEN status='Pass' THEN 1 ELSE 0 END) as sum_pass,
+               SUM(CASE WHEN status='Fail' THEN 1 ELSE 0 END) as sum_fail
+        FROM ProductionStatus
+        WHERE created_at >= ? AND created_at < ? {clause}
+        GROUP BY MONTH(created_at)
+    """
+    with pool.acquire() as conn:
         cur = conn.cursor()
-        params_exec = [year] + params
+        params_exec = make_date_range(datetime.date(year, 1, 1), datetime.date(year, 12, 31)) + params
         cur.execute(q, params_exec)
         rows = cur.fetchall()
-        mapm = {int(r[0]): {"pass": int(r[1] or 0), "fail": int(r[2] or 0)} for r in rows}
-        labels = [f"Tháng {m}" for m in range(1, 13)]
-        pass_list = [mapm[m]["pass"] if m in mapm else 0 for m in range(1, 13)]
-        fail_list = [mapm[m]["fail"] if m in mapm else 0 for m in range(1, 13)]
-        return {"year": year, "labels": labels, "pass": pass_list, "fail": fail_list}
-    finally:
-        try: conn.close()
-        except: pass
+    labels = [f"Tháng {m}" for m in range(1, 13)]
+    pass_list = [0] * 12
+    fail_list = [0] * 12
+    for m, p, f in rows:
+        pass_list[m - 1] = p
+        fail_list[m - 1] = f
+    return {"year": year, "labels": labels, "pass": pass_list, "fail": fail_list}
 
 
 # Logs endpoints (per-day summary + set daily metric)
-@app.get("/logs/day/{date_str}")
+@app.get("/logs/day/{date_str}", response_model=List[DeviceLogOut])
+@cached("logs", ttl=day_ttl)
 def logs_day(date_str: str, device: Optional[str] = None):
-    try:
-        datetime.date.fromisoformat(date_str)
-    except Exception:
-        raise HTTPException(status_code=400, detail="date_str must be YYYY-MM-DD")
-    conn = get_conn()
-    try:
+    day = parse_date_str(date_str)
+    with pool.acquire() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT name FROM devices ORDER BY id")
-        device_rows = cur.fetchall()
-        device_names = [r[0] for r in device_rows]
-
         clause, params = make_device_filter_clause(device)
+        # one batch, three result sets: device names, per-device pass/fail, daily metrics.
+        # NOCOUNT is session state and this connection goes back to the pool, so switch it
+        # off again at the end of the batch (otherwise later UPDATE/DELETE rowcounts read -1)
         q = f"""
+            SET NOCOUNT ON;
+            SELECT name FROM devices ORDER BY id;
             SELECT device_id,
                    SUM(CASE WHEN status = 'Pass' THEN 1 ELSE 0 END) as pass_sum,
                    SUM(CASE WHEN status = 'Fail' THEN 1 ELSE 0 END) as fail_sum
             FROM ProductionStatus
-            WHERE CONVERT(varchar(10), created_at, 120) = ? { 'AND device_id = ?' if device else '' }
-            GROUP BY device_id
+            WHERE created_at >= ? AND created_at < ? {clause}
+            GROUP BY device_id;
+            SELECT device_id, metric FROM DailyMetrics WHERE [date] = ?;
+            SET NOCOUNT OFF;
         """
-        exec_params = (date_str, *params) if params else (date_str,)
+        exec_params = make_date_range(day, day) + params + [day]
         cur.execute(q, exec_params)
-        rows = cur.fetchall()
-        stats = {r[0]: {"Pass": int(r[1] or 0), "Fail": int(r[2] or 0)} for r in rows}
-
-        cur.execute("SELECT device_id, metric FROM DailyMetrics WHERE [date] = ?", (date_str,))
-        metric_rows = cur.fetchall()
-        metrics = {r[0]: r[1] for r in metric_rows}
-
-        all_devices = set(device_names) | set(stats.keys()) | set(metrics.keys())
-        if device:
-            all_devices = {device}
-
-        out = []
-        for dev in sorted(all_devices):
-            p = stats.get(dev, {}).get("Pass", 0)
-            f = stats.get(dev, {}).get("Fail", 0)
-            tot = p + f
-            out.append({
-                "device_id": dev,
-                "name": dev,
-                "pass": p,
-                "fail": f,
-                "total": tot,
-                "metric": metrics.get(dev) or ""
-            })
-        return out
-    finally:
-        conn.close()
-
+        device_names = [r[0] for r in cur.fetchall()]
+        cur.nextset()
+        stats = {r[0]: {"Pass": int(r[1] or 0), "Fail": int(r[2] or 0)} for r in cur.fetchall()}
+        cur.nextset()
+        metrics = {r[0]: r[1] for r in cur.fetchall()}
 
-@app.post("/logs")
+    all_devices = set(device_names) | set(stats.keys()) | set(metrics.keys())
+    if device:
+        all_devices = {device}
+
+    out = []
+    for dev in sorted(all_devices):
+        p = stats.get(dev, {}).get("Pass", 0)
+        f = stats.get(dev, {}).get("Fail", 0)
+        tot = p + f
+        out.append({
+            "device_id": dev,
+            "name": dev,
+            "pass": p,
+            "fail": f,
+            "total": tot,
+            "metric": metrics.get(dev) or ""
+        })
+    return out
+
+
+@app.post("/logs", response_model=OkOut)
 def post_logs(payload: DailyMetricIn):
+    day = parse_date_str(payload.date, "date")
     try:
-        datetime.date.fromisoformat(payload.date)
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM DailyMetrics WHERE device_id = ? AND [date] = ?", (payload.device_id, payload.date))
-        exists = cur.fetchone()[0]
-        if exists:
-            cur.execute("UPDATE DailyMetrics SET metric = ? WHERE device_id = ? AND [date] = ?", (payload.metric, payload.device_id, payload.date))
-        else:
-            cur.execute("INSERT INTO DailyMetrics (device_id, [date], metric) VALUES (?, ?, ?)", (payload.device_id, payload.date, payload.metric))
-        conn.commit()
+        with pool.acquire() as conn:
+            cur = conn.cursor()
+            # single-statement upsert; HOLDLOCK keeps concurrent posts for the same key from racing
+            cur.execute("""
+                MERGE dbo.DailyMetrics WITH (HOLDLOCK) AS t
+                USING (VALUES (?, ?, ?)) AS s (device_id, [date], metric)
+                    ON t.device_id = s.device_id AND t.[date] = s.[date]
+                WHEN MATCHED THEN
+                    UPDATE SET metric = s.metric
+                WHEN NOT MATCHED THEN
+                    INSERT (device_id, [date], metric) VALUES (s.device_id, s.[date], s.metric);
+            """, (payload.device_id, day, payload.metric))
+            conn.commit()
+        invalidate_cache("logs")
         return {"ok": True}
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
 
 
 if __name__ == "__main__":
-    print("[INFO] Starting uvicorn on 127.0.0.1:5500")
-    uvicorn.run("backend:app", host="127.0.0.1", port=5500, reload=True)
+    # Each worker is a separate process with its own DB pool and response cache, and a
+    # write only invalidates the cache of the worker that served it. Stay on one worker
+    # unless stale reads (up to the cache TTLs) are acceptable.
+    workers = int(os.environ.get("WEB_WORKERS", "1"))
+    print(f"[INFO] Starting uvicorn on 127.0.0.1:5500 with {workers} worker(s)")
+    uvicorn.run("backend:app", host="127.0.0.1", port=5500, workers=workers)
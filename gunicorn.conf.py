@@ -0,0 +1,18 @@
+# gunicorn.conf.py
+# Linux deployment: gunicorn backend:app -c gunicorn.conf.py
+# (gunicorn does not run on Windows; there use `python backend.py`, which starts uvicorn workers)
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5500")
+
+# Every worker has its own DB pool of DB_POOL_SIZE connections (keep workers * DB_POOL_SIZE
+# below the SQL Server connection limit) and its own in-memory response cache. A write only
+# invalidates the cache of the worker that served it, so more than one worker means other
+# workers can serve stale reads until their cache TTLs expire.
+workers = int(os.environ.get("WEB_WORKERS", "1"))
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Import the app once in the master; the DB pool connects lazily, so no connection
+# is opened before the fork and shared between workers.
+preload_app = True
+keepalive = 30
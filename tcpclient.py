@@ -13,23 +13,40 @@ def connect_db():
         "Trusted_Connection=yes;"
     )
 
-def insert_data(device_id, status):
+# Gom nhiều dòng rồi ghi một lần: flush khi đủ BATCH_SIZE dòng hoặc sau FLUSH_INTERVAL giây
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+# Phần dòng chưa có ký tự kết thúc dài quá mức này thì bỏ đi (server không gửi \r/\n)
+MAX_LINE_BUFFER = 64 * 1024
+
+def insert_batch(conn, rows):
+    """Ghi các tuple (device_id, status, created_at) trong rows vào DB; lỗi pyodbc được ném ra cho caller."""
+    cursor = conn.cursor()
+    cursor.fast_executemany = True
+    cursor.executemany("""
+        INSERT INTO ProductionStatus (device_id, status, created_at)
+        VALUES (?, ?, ?)
+    """, rows)
+    conn.commit()
+    cursor.close()
+
+def close_db(conn):
     try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        now = datetime.now()
-        cursor.execute("""
-            INSERT INTO ProductionStatus (device_id, status, created_at)
-            VALUES (?, ?, ?)
-        """, (device_id, status, now))
-        conn.commit()
-        cursor.close()
         conn.close()
-        print(f"✅ Đã lưu vào DB: {device_id} | {status} | {now}")
-    except Exception as e:
-        print("❌ Lỗi khi lưu DB:", e)
+    except pyodbc.Error:
+        pass
 
 # --- Parse line: extract device and status ---
+# Compiled once at import; parse_line runs for every line received over TCP
+_BRACKET_RE = re.compile(r'^\[[^\]]*\]\s*')
+_HEADER_RE = re.compile(r'^[^:]{0,80}:\s*')
+_ALPHA_RE = re.compile(r'[A-Za-z]')
+_SPLIT_RE = re.compile(r'[\s,;|]+')
+_DEV_SM_RE = re.compile(r'^[SM]\d+$', re.IGNORECASE)
+_SN_RE = re.compile(r'^(SN[:\-]?\s*([A-Za-z0-9\-]+))$', re.IGNORECASE)
+_UPPER_RE = re.compile(r'^[A-Z]{2,}$')
+_SPECIAL_RE = re.compile(r'[\[:,;|]')
+
 def parse_line(line):
     """
     Trả về tuple (device_or_None, status_or_None)
@@ -48,15 +65,27 @@ def parse_line(line):
 
     s = line.strip()
 
+    # Fast path for the common frames "Pass" / "M1 Fail": no log prefix, header or
+    # separators, so the heuristics below would return exactly this
+    sp = s.split()
+    if 1 <= len(sp) <= 2:
+        last = sp[-1].upper()
+        if (last == "PASS" or last == "FAIL") and not _SPECIAL_RE.search(s):
+            status = "Pass" if last == "PASS" else "Fail"
+            if len(sp) == 1:
+                return (None, status)
+            if _DEV_SM_RE.match(sp[0]):
+                return (sp[0].upper(), status)
+
     # Remove leading bracketed log prefixes like [2025-09-10 ...] [Info] ...:
     # remove repeated bracket groups and trailing colon
     while s.startswith('['):
-        m = re.match(r'^\[[^\]]*\]\s*', s)
+        m = _BRACKET_RE.match(s)
         if not m:
             break
         s = s[m.end():].lstrip()
     # remove any prefix up to last ':' if it's part of log header
-    if ':' in s and re.match(r'^[^:]{0,80}:\s*', s):
+    if ':' in s and _HEADER_RE.match(s):
         # heuristic: if there is a "):" pattern earlier (like "...): SN Fail") remove header
         # remove everything up to last ') :' or up to first ': ' if header-like
         # Try to remove header ending with '):' first
@@ -65,38 +94,35 @@ def parse_line(line):
         else:
             # remove first "timestamp-like" header if present
             parts = s.split(':', 1)
-            if len(parts) == 2 and re.search(r'[A-Za-z]', parts[1]):
+            if len(parts) == 2 and _ALPHA_RE.search(parts[1]):
                 s = parts[1].strip()
 
     # Split tokens
-    tokens = [t for t in re.split(r'\s+|,|;|\||\t', s) if t]
+    tokens = [t for t in _SPLIT_RE.split(s) if t]
     if not tokens:
         return (None, None)
 
-    # Normalize tokens for matching
-    tokens_upper = [t.upper() for t in tokens]
-
-    # Find status token (PASS/FAIL)
+    # One pass over the tokens:
+    #   - status: first PASS/FAIL token (case-insensitive)
+    #   - device 1) first S/M + digits token (e.g. M1, S2)
     status = None
-    for i, tok in enumerate(tokens_upper):
-        if tok in ("PASS", "FAIL"):
-            status = "Pass" if tok == "PASS" else "Fail"
-            # remove tokens around? not necessary here
-            break
-
-    # Find device token:
     device = None
-
-    # 1) look for S/M + digits (e.g. M1, S2)
     for t in tokens:
-        if re.match(r'^[SM]\d+$', t, re.IGNORECASE):
+        if status is None:
+            tok = t.upper()
+            if tok == "PASS":
+                status = "Pass"
+            elif tok == "FAIL":
+                status = "Fail"
+        if device is None and _DEV_SM_RE.match(t):
             device = t.upper()
+        if status and device:
             break
 
     # 2) look for SN patterns: SN123, SN:1234, SN-ABC, or token exactly 'SN'
     if not device:
         for t in tokens:
-            m = re.match(r'^(SN[:\-]?\s*([A-Za-z0-9\-]+))$', t, re.IGNORECASE)
+            m = _SN_RE.match(t)
             if m:
                 # If token like SN:123 or SN-123 or SN123
                 # normalize to SN + captured
@@ -105,7 +131,7 @@ def parse_line(line):
                 device = raw.replace(':', '').replace('-', '').replace(' ', '').upper()
                 break
         # if none matched but the first token is literally 'SN' then use 'SN'
-        if not device and tokens_upper[0] == 'SN':
+        if not device and tokens[0].upper() == 'SN':
             device = 'SN'
 
     # 3) fallback: if first token looks like a device and not a PASS/FAIL, use it
@@ -113,7 +139,7 @@ def parse_line(line):
         first_tok = tokens[0]
         if first_tok.upper() not in ("PASS", "FAIL"):
             # avoid setting to common words like INFO, TCPCLIENT, etc.
-            if not re.match(r'^[A-Z]{2,}$', first_tok) or re.match(r'^[SM]\d+$', first_tok, re.IGNORECASE) or first_tok.upper().startswith('SN'):
+            if not _UPPER_RE.match(first_tok) or _DEV_SM_RE.match(first_tok) or first_tok.upper().startswith('SN'):
                 device = first_tok
 
     return (device, status)
@@ -124,77 +150,169 @@ SERVER_IP = "127.0.0.1"
 SERVER_PORT = 10002
 
 def run_client(retry_delay=5):
-    while True:
+    conn = None  # mở ở lần flush đầu tiên, giữ suốt vòng đời client, chỉ mở lại khi driver báo lỗi
+    pending = []
+    last_flush = time.monotonic()
+
+    def drop_conn():
+        nonlocal conn
+        if conn is not None:
+            close_db(conn)
+        conn = None
+
+    def write(rows):
+        """
+        Ghi rows vào DB. Trả về:
+          - "ok":   đã lưu
+          - "data": lỗi không phải do kết nối (vd. dữ liệu quá dài), đã rollback
+          - "conn": không có kết nối DB (đã kết nối lại và thử thêm một lần)
+        """
+        nonlocal conn
+        for attempt in range(2):
+            if conn is None:
+                try:
+                    conn = connect_db()
+                except pyodbc.Error as e:
+                    print("⚠️ Không kết nối được DB:", e)
+                    return "conn"
+            try:
+                insert_batch(conn, rows)
+                return "ok"
+            except (pyodbc.OperationalError, pyodbc.InterfaceError) as e:
+                print("⚠️ Mất kết nối DB, kết nối lại:", e)
+                drop_conn()
+            except pyodbc.Error as e:
+                print("❌ Lỗi khi lưu DB:", e)
+                try:
+                    conn.rollback()
+                except pyodbc.Error:
+                    drop_conn()
+                return "data"
+        return "conn"
+
+    def flush():
+        # never raises: it is also called from the receive loop's error handler
+        nonlocal last_flush
+        last_flush = time.monotonic()
+        if not pending:
+            return
         try:
-            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client.settimeout(10)
-            client.connect((SERVER_IP, SERVER_PORT))
-            client.settimeout(None)  # normal blocking
-            print(f"Đã kết nối tới {SERVER_IP}:{SERVER_PORT}")
-
-            buffer = ""
-            current_device = None  # lưu tên máy hiện tại
-
-            while True:
-                data = client.recv(4096)
-                if not data:
-                    # server closed? try reconnect
-                    print("⚠️ Kết nối bị đóng bởi server, thử kết nối lại...")
-                    client.close()
-                    break
-                # decode and preserve potential multi-line
-                text = data.decode("utf-8", errors="ignore")
-                # append to buffer then splitlines
-                buffer += text
-                lines = buffer.splitlines()
-                # if last char not newline, keep last partial in buffer
-                if not buffer.endswith("\n") and not buffer.endswith("\r"):
-                    buffer = lines.pop() if lines else ""
-                else:
-                    buffer = ""
-
-                for line in lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    print(f"📩 Nhận: {line}")
-
-                    # parse
-                    device_token, status_token = parse_line(line)
-                    # if parse returns device but no status: treat as current device update
-                    if device_token and not status_token:
-                        current_device = device_token
-                        print(f"➡️ Cập nhật thiết bị hiện tại: {current_device}")
+            result = write(pending)
+            if result == "data":
+                # one bad row fails the whole executemany; retry row by row so only it is lost
+                saved = 0
+                for i, row in enumerate(pending):
+                    r = write([row])
+                    if r == "ok":
+                        saved += 1
+                    elif r == "data":
+                        print("❌ Bỏ dòng lỗi:", row)
+                    else:
+                        print(f"❌ Mất kết nối DB, bỏ {len(pending) - i} dòng chưa lưu")
+                        break
+                print(f"✅ Đã lưu {saved}/{len(pending)} dòng vào DB")
+            elif result == "ok":
+                print(f"✅ Đã lưu {len(pending)} dòng vào DB")
+            else:
+                print(f"❌ Không lưu được {len(pending)} dòng vào DB, bỏ qua")
+        except Exception as e:
+            print(f"❌ Lỗi khi lưu DB, bỏ {len(pending)} dòng:", e)
+        finally:
+            pending.clear()
+
+    try:
+        while True:
+            try:
+                client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                client.settimeout(10)
+                client.connect((SERVER_IP, SERVER_PORT))
+                # recv hết hạn sau FLUSH_INTERVAL để vẫn flush được khi server im lặng
+                client.settimeout(FLUSH_INTERVAL)
+                print(f"Đã kết nối tới {SERVER_IP}:{SERVER_PORT}")
+
+                buf = bytearray()
+                discarding = False  # đang bỏ phần còn lại của một dòng quá dài
+                current_device = None  # lưu tên máy hiện tại
+
+                while True:
+                    try:
+                        data = client.recv(4096)
+                    except socket.timeout:
+                        flush()
                         continue
+                    if not data:
+                        # server closed? try reconnect
+                        print("⚠️ Kết nối bị đóng bởi server, thử kết nối lại...")
+                        flush()
+                        client.close()
+                        break
+                    # only decode up to the last '\r' or '\n'; a partial line (even a split
+                    # UTF-8 character) stays in buf until the rest arrives. A "\r\n" split
+                    # across two packets just yields an empty line, which is skipped below.
+                    buf.extend(data)
+                    lines = []
+                    end = max(buf.rfind(b"\n"), buf.rfind(b"\r"))
+                    if end >= 0:
+                        lines = buf[:end].decode("utf-8", errors="ignore").splitlines()
+                        del buf[:end + 1]
+                        if discarding:
+                            lines = lines[1:]  # tail of the oversized line
+                            discarding = False
+                    if len(buf) > MAX_LINE_BUFFER:
+                        print(f"⚠️ Dòng dài hơn {MAX_LINE_BUFFER} byte mà không có ký tự xuống dòng, bỏ qua")
+                        buf.clear()
+                        discarding = True
 
-                    # if status present but device missing -> use last current_device
-                    if status_token:
-                        if device_token:
-                            # if message includes both device & status, prefer that device and update current_device
+                    for line in lines:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        print(f"📩 Nhận: {line}")
+
+                        # parse
+                        device_token, status_token = parse_line(line)
+                        # if parse returns device but no status: treat as current device update
+                        if device_token and not status_token:
                             current_device = device_token
-                        if current_device is None:
-                            print("⚠️ Chưa có device_id, bỏ qua (không tìm thấy thiết bị trong dòng và cũng chưa có device hiện tại)")
+                            print(f"➡️ Cập nhật thiết bị hiện tại: {current_device}")
                             continue
-                        # insert
-                        insert_data(current_device, status_token)
-                        # send ACK back
-                        try:
-                            client.sendall(b"ACK\n")
-                            print("↩️ Đã gửi ACK về server TCP")
-                        except Exception as e:
-                            print("⚠️ Lỗi khi gửi ACK:", e)
-                    else:
-                        # nothing to do
-                        print("⚠️ Dòng không chứa Pass/Fail và không phải cập nhật device")
 
-        except Exception as ex:
-            print("❌ Lỗi kết nối hoặc runtime:", ex)
-            try:
-                client.close()
-            except:
-                pass
-            print(f"⏳ Thử kết nối lại sau {retry_delay}s...")
-            time.sleep(retry_delay)
+                        # if status present but device missing -> use last current_device
+                        if status_token:
+                            if device_token:
+                                # if message includes both device & status, prefer that device and update current_device
+                                current_device = device_token
+                            if current_device is None:
+                                print("⚠️ Chưa có device_id, bỏ qua (không tìm thấy thiết bị trong dòng và cũng chưa có device hiện tại)")
+                                continue
+                            # queue for the next batch insert
+                            pending.append((current_device, status_token, datetime.now()))  # giờ nhận, không phải giờ flush
+                            # send ACK back
+                            try:
+                                client.sendall(b"ACK\n")
+                                print("↩️ Đã gửi ACK về server TCP")
+                            except Exception as e:
+                                print("⚠️ Lỗi khi gửi ACK:", e)
+                        else:
+                            # nothing to do
+                            print("⚠️ Dòng không chứa Pass/Fail và không phải cập nhật device")
+
+                    if len(pending) >= BATCH_SIZE or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                        flush()
+
+            except Exception as ex:
+                print("❌ Lỗi kết nối hoặc runtime:", ex)
+                flush()
+                try:
+                    client.close()
+                except:
+                    pass
+                print(f"⏳ Thử kết nối lại sau {retry_delay}s...")
+                time.sleep(retry_delay)
+    finally:
+        # KeyboardInterrupt / thoát: ghi nốt các dòng còn trong hàng đợi
+        flush()
+        drop_conn()
 
 if __name__ == "__main__":
     run_client()